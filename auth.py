@@ -1,12 +1,10 @@
 from datetime import datetime, timedelta
 from typing import Optional
 
-import jwt
-from jwt import PyJWTError
-from passlib.hash import pbkdf2_sha256
-
 from config import JWT_SECRET_KEY, JWT_ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES
-import jwt as _jwt_lib
+
+# jwt and passlib are imported inside the functions that use them so that
+# importing this module (and building the app) stays cheap
 
 
 # Custom exceptions for FastAPI exception handlers
@@ -29,14 +27,20 @@ from db_models import UserORM
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     if not hashed_password:
         return False
+    from passlib.hash import pbkdf2_sha256
+
     return pbkdf2_sha256.verify(plain_password, hashed_password)
 
 
 def get_password_hash(password: str) -> str:
+    from passlib.hash import pbkdf2_sha256
+
     return pbkdf2_sha256.hash(password)
 
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
+    import jwt
+
     to_encode = data.copy()
     if expires_delta:
         expire = datetime.utcnow() + expires_delta
@@ -48,13 +52,15 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
 
 
 def decode_access_token(token: str) -> dict | None:
+    import jwt
+
     try:
         payload = jwt.decode(token, JWT_SECRET_KEY, algorithms=[JWT_ALGORITHM])
         return payload
-    except _jwt_lib.ExpiredSignatureError:
+    except jwt.ExpiredSignatureError:
         # token expired
         raise JWTExpiredError()
-    except (_jwt_lib.InvalidSignatureError, _jwt_lib.DecodeError, PyJWTError):
+    except (jwt.InvalidSignatureError, jwt.DecodeError, jwt.PyJWTError):
         # invalid token / signature verification failed
         raise JWTInvalidError()
 
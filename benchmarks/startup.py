@@ -0,0 +1,107 @@
+"""Startup-time benchmark.
+
+Reports the slowest imports of ``main`` (from ``python -X importtime``) and the
+time from launching ``uvicorn main:app`` to the first successful response from
+/healthcheck. Exits non-zero if the median time exceeds ``--max-seconds``, so it
+can be used in CI to keep cold starts from regressing.
+
+    python benchmarks/startup.py --runs 5 --max-seconds 2.0
+"""
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _env(create_schema: bool) -> dict:
+    env = dict(os.environ)
+    env.setdefault("DATABASE_URL", "sqlite://")
+    env["CREATE_SCHEMA"] = "true" if create_schema else "false"
+    return env
+
+
+def import_profile(top: int, create_schema: bool) -> tuple[float, list[tuple[int, str]]]:
+    """Return (total import time of main in ms, slowest `top` modules by cumulative time)."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=ROOT,
+        env=_env(create_schema),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        modules.append((int(cumulative), name.strip()))
+    total = next(us for us, name in modules if name == "main")
+    return total / 1000, sorted(modules, reverse=True)[:top]
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def time_to_first_response(create_schema: bool, timeout: float = 30.0) -> float:
+    """Seconds from spawning the server process to the first 200 from /healthcheck."""
+    port = _free_port()
+    url = f"http://127.0.0.1:{port}/healthcheck"
+    started = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT,
+        env=_env(create_schema),
+    )
+    try:
+        while time.perf_counter() - started < timeout:
+            if proc.poll() is not None:
+                raise RuntimeError(f"server exited with code {proc.returncode}")
+            try:
+                with urllib.request.urlopen(url, timeout=1) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - started
+            except (urllib.error.URLError, ConnectionError):
+                time.sleep(0.01)
+        raise TimeoutError(f"no response from {url} within {timeout}s")
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15, help="number of slowest imports to list")
+    parser.add_argument("--max-seconds", type=float, default=None, help="fail if median time-to-first-response is above this")
+    parser.add_argument("--create-schema", action="store_true", help="run create_all on startup, as in development")
+    args = parser.parse_args()
+
+    total_ms, slowest = import_profile(args.top, args.create_schema)
+    print(f"import main: {total_ms:.1f} ms")
+    for us, name in slowest:
+        print(f"  {us / 1000:8.1f} ms  {name}")
+
+    samples = [time_to_first_response(args.create_schema) for _ in range(args.runs)]
+    median = statistics.median(samples)
+    print(f"time to first response: median {median * 1000:.0f} ms, "
+          f"min {min(samples) * 1000:.0f} ms, max {max(samples) * 1000:.0f} ms ({args.runs} runs)")
+
+    if args.max_seconds is not None and median > args.max_seconds:
+        print(f"FAIL: median {median:.3f}s exceeds --max-seconds {args.max_seconds}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
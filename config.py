@@ -1,9 +1,14 @@
 import os
-from dotenv import load_dotenv
+from dataclasses import dataclass
 from urllib.parse import quote_plus
 
-# Load variables from a local .env file if present (works both locally and in Docker)
-load_dotenv()
+# Load variables from a local .env file if present (works both locally and in Docker).
+# python-dotenv is only imported when there is a file to read.
+ENV_FILE: str = os.getenv("ENV_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".env"))
+if os.path.isfile(ENV_FILE):
+    from dotenv import load_dotenv
+
+    load_dotenv(ENV_FILE)
 
 # Debug/behavior flags
 PROPAGATE_EXCEPTIONS: bool = True
@@ -35,7 +40,35 @@ def _build_database_url() -> str:
     return "sqlite:///./app.db"
 
 DATABASE_URL: str = _build_database_url()
+# Run Base.metadata.create_all on startup. Disable in production and rely on alembic migrations.
+CREATE_SCHEMA: bool = os.getenv("CREATE_SCHEMA", "true").lower() == "true"
 
 JWT_SECRET_KEY: str = os.getenv("JWT_SECRET_KEY")
 JWT_ALGORITHM: str = "HS256"
-ACCESS_TOKEN_EXPIRE_MINUTES: int = 60 * 24 
\ No newline at end of file
+ACCESS_TOKEN_EXPIRE_MINUTES: int = 60 * 24 
+
+# Idempotency-Key support for retried POST requests
+IDEMPOTENCY_TTL_SECONDS: int = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", str(60 * 60 * 24)))
+IDEMPOTENCY_CACHE_SIZE: int = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "1024"))
+IDEMPOTENCY_WAIT_TIMEOUT_SECONDS: float = float(os.getenv("IDEMPOTENCY_WAIT_TIMEOUT_SECONDS", "30"))
+IDEMPOTENCY_PURGE_INTERVAL_SECONDS: float = float(os.getenv("IDEMPOTENCY_PURGE_INTERVAL_SECONDS", "300"))
+IDEMPOTENCY_PURGE_BATCH_SIZE: int = int(os.getenv("IDEMPOTENCY_PURGE_BATCH_SIZE", "500"))
+
+# Event stream (GET /events)
+EVENTS_BACKEND: str = os.getenv("EVENTS_BACKEND", "local")  # "local" or "postgres"
+EVENTS_BUFFER_SIZE: int = int(os.getenv("EVENTS_BUFFER_SIZE", "100"))
+EVENTS_KEEPALIVE_SECONDS: float = float(os.getenv("EVENTS_KEEPALIVE_SECONDS", "15"))
+EVENTS_PG_CHANNEL: str = os.getenv("EVENTS_PG_CHANNEL", "app_events")
+
+
+@dataclass(frozen=True)
+class Settings:
+    """Settings consumed by main.create_app; defaults come from the environment above."""
+    api_title: str = API_TITLE
+    api_version: str = API_VERSION
+    openapi_url_prefix: str = OPENAPI_URL_PREFIX
+    openapi_swagger_ui_path: str = OPENAPI_SWAGGER_UI_PATH
+    openapi_swagger_ui_url: str = OPENAPI_SWAGGER_UI_URL
+    redoc_path: str = REDOC_PATH
+    database_url: str = DATABASE_URL
+    create_schema: bool = CREATE_SCHEMA
@@ -1,3 +1,4 @@
+import threading
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
 from sqlalchemy.exc import OperationalError
@@ -5,11 +6,39 @@ from config import DATABASE_URL
 
 Base = declarative_base()
 
-engine = create_engine(DATABASE_URL, future=True)
-SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False, expire_on_commit=False)
+# The engine (and with it the DB driver import) is created on first use, not at import time
+_database_url = DATABASE_URL
+_engine = None
+_engine_lock = threading.Lock()
+SessionLocal = sessionmaker(autoflush=False, autocommit=False, expire_on_commit=False)
+
+def configure_database(url: str):
+    """Point the app at another database; the engine is rebuilt lazily on next use."""
+    global _database_url, _engine
+    with _engine_lock:
+        if url == _database_url:
+            return
+        if _engine is not None:
+            _engine.dispose()
+            _engine = None
+        _database_url = url
+
+def get_engine():
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                engine = create_engine(_database_url, future=True)
+                SessionLocal.configure(bind=engine)
+                _engine = engine
+    return _engine
+
+def new_session():
+    get_engine()
+    return SessionLocal()
 
 def get_db():
-    db = SessionLocal()
+    db = new_session()
     try:
         yield db
     finally:
@@ -17,6 +46,6 @@ def get_db():
 
 def init_db():
     try:
-        Base.metadata.create_all(bind=engine)
+        Base.metadata.create_all(bind=get_engine())
     except OperationalError as e:
         print(f"Database initialization failed: {e}")
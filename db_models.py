@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Numeric
+from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Numeric, Text, SmallInteger, UniqueConstraint, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from database import Base
@@ -12,6 +12,8 @@ class UserORM(Base):
 
     records = relationship("RecordORM", back_populates="user", cascade="all, delete-orphan")
     account = relationship("AccountORM", back_populates="user", uselist=False, cascade="all, delete-orphan")
+    deposits = relationship("DepositORM", back_populates="user", cascade="all, delete-orphan")
+    checkpoints = relationship("BalanceCheckpointORM", cascade="all, delete-orphan")
 
 
 class CategoryORM(Base):
@@ -24,6 +26,7 @@ class CategoryORM(Base):
 
 class RecordORM(Base):
     __tablename__ = "records"
+    __table_args__ = (Index("ix_records_user_id_timestamp", "user_id", "timestamp"),)
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -43,3 +46,41 @@ class AccountORM(Base):
     balance = Column(Numeric(14, 2), nullable=False, default=0)
 
     user = relationship("UserORM", back_populates="account")
+
+
+class DepositORM(Base):
+    __tablename__ = "deposits"
+    __table_args__ = (Index("ix_deposits_user_id_timestamp", "user_id", "timestamp"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    amount = Column(Numeric(14, 2), nullable=False)
+    timestamp = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+    user = relationship("UserORM", back_populates="deposits")
+
+
+class BalanceCheckpointORM(Base):
+    """Account balance of all ledger entries strictly before ``as_of`` (a month start)."""
+    __tablename__ = "balance_checkpoints"
+    __table_args__ = (UniqueConstraint("user_id", "as_of", name="uq_balance_checkpoints_user_as_of"),)
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    as_of = Column(DateTime, nullable=False)
+    balance = Column(Numeric(14, 2), nullable=False)
+
+
+class IdempotencyKeyORM(Base):
+    __tablename__ = "idempotency_keys"
+    __table_args__ = (UniqueConstraint("user_id", "key", name="uq_idempotency_keys_user_key"),)
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    key = Column(String(255), nullable=False)
+    request_hash = Column(String(64), nullable=False)
+    # NULL status_code means the first request is still in flight
+    status_code = Column(SmallInteger, nullable=True)
+    response_body = Column(Text, nullable=True)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    expires_at = Column(DateTime, nullable=False, index=True)
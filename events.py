@@ -0,0 +1,261 @@
+import asyncio
+import json
+import signal
+import threading
+import uuid
+from datetime import datetime
+from typing import Any, AsyncIterator, Callable
+
+from sqlalchemy import make_url, text
+
+from config import (
+    EVENTS_BACKEND,
+    EVENTS_BUFFER_SIZE,
+    EVENTS_KEEPALIVE_SECONDS,
+    EVENTS_PG_CHANNEL,
+)
+
+RECORD_CREATED = "record_created"
+RECORD_DELETED = "record_deleted"
+BALANCE_CHANGED = "balance_changed"
+
+# Sentinel put on a subscriber queue when it is being disconnected
+_CLOSE = None
+
+
+class Subscriber:
+    """One open event stream. Lives on the event loop that serves the connection."""
+
+    def __init__(self, hub: "EventHub", user_id: int, loop: asyncio.AbstractEventLoop, buffer_size: int):
+        self.hub = hub
+        self.user_id = user_id
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=buffer_size + 1)
+        self.buffer_size = buffer_size
+        self.closed = False
+        self.close_reason: str | None = None
+
+    def offer(self, event: dict) -> None:
+        # always called on self.loop, so no locking is needed around the queue
+        if self.closed:
+            return
+        if self.queue.qsize() >= self.buffer_size:
+            self.close("slow_consumer")
+            return
+        self.queue.put_nowait(event)
+
+    def close(self, reason: str) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        self.close_reason = reason
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(_CLOSE)
+
+
+class EventHub:
+    """In-process pub/sub of events, fanned out to the subscribers of each user."""
+
+    def __init__(self, buffer_size: int = EVENTS_BUFFER_SIZE):
+        self.buffer_size = buffer_size
+        self._subscribers: dict[int, set[Subscriber]] = {}
+        self._lock = threading.Lock()
+        self.closing = False
+
+    def subscribe(self, user_id: int) -> Subscriber:
+        sub = Subscriber(self, user_id, asyncio.get_running_loop(), self.buffer_size)
+        with self._lock:
+            if not self.closing:
+                self._subscribers.setdefault(user_id, set()).add(sub)
+        if self.closing:
+            sub.close("shutdown")
+        return sub
+
+    def unsubscribe(self, sub: Subscriber) -> None:
+        with self._lock:
+            subs = self._subscribers.get(sub.user_id)
+            if subs is not None:
+                subs.discard(sub)
+                if not subs:
+                    del self._subscribers[sub.user_id]
+
+    def dispatch(self, event: dict) -> None:
+        """Deliver an event to local subscribers. Safe to call from any thread."""
+        with self._lock:
+            subs = list(self._subscribers.get(event["user_id"], ()))
+        for sub in subs:
+            try:
+                sub.loop.call_soon_threadsafe(sub.offer, event)
+            except RuntimeError:
+                # the loop serving this subscriber is already closed
+                self.unsubscribe(sub)
+
+    def close_all(self, reason: str = "shutdown") -> None:
+        """End every open stream and refuse new ones; used when the server is stopping."""
+        with self._lock:
+            self.closing = True
+            subs = [sub for group in self._subscribers.values() for sub in group]
+        for sub in subs:
+            try:
+                sub.loop.call_soon_threadsafe(sub.close, reason)
+            except RuntimeError:
+                pass
+
+
+def install_shutdown_signal_handlers(hub: EventHub) -> Callable[[], None]:
+    """Close all streams as soon as SIGINT/SIGTERM arrives, then run the previous handler.
+
+    Uvicorn waits for open connections to finish before it runs the lifespan shutdown,
+    so an open stream would otherwise block a graceful stop until the client goes away.
+    Must be called from the lifespan startup; returns a function restoring the old handlers.
+    """
+    if threading.current_thread() is not threading.main_thread():
+        return lambda: None
+    loop = asyncio.get_running_loop()
+    previous = {}
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        handler = signal.getsignal(sig)
+        if not callable(handler):
+            continue
+
+        def chained(signum, frame, _previous=handler):
+            # defer to the loop: the hub lock may be held by the code this signal interrupted
+            loop.call_soon_threadsafe(hub.close_all)
+            _previous(signum, frame)
+
+        previous[sig] = handler
+        signal.signal(sig, chained)
+
+    def restore() -> None:
+        for sig, handler in previous.items():
+            signal.signal(sig, handler)
+
+    return restore
+
+
+class LocalBackend:
+    """Single-process backend: events go straight to the local hub."""
+
+    def __init__(self, hub: EventHub):
+        self.hub = hub
+
+    def start(self) -> None:
+        pass
+
+    def stop(self) -> None:
+        pass
+
+    def publish(self, event: dict) -> None:
+        self.hub.dispatch(event)
+
+
+class PostgresBackend:
+    """Cross-worker backend using Postgres LISTEN/NOTIFY.
+
+    Every worker publishes with NOTIFY and a listener thread per worker feeds
+    whatever arrives on the channel into its local hub.
+    """
+
+    def __init__(self, hub: EventHub, database_url: str | None = None, channel: str = EVENTS_PG_CHANNEL):
+        self.hub = hub
+        self.channel = channel
+        self.database_url = database_url
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self) -> None:
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._listen, name="events-listener", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def publish(self, event: dict) -> None:
+        from database import get_engine
+
+        with get_engine().connect() as conn:
+            conn.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": self.channel, "payload": json.dumps(event)})
+            conn.commit()
+
+    def _listen(self) -> None:
+        import psycopg
+        from database import get_engine
+
+        # psycopg wants a plain libpq URL, without SQLAlchemy's "+driver" suffix
+        url = make_url(self.database_url) if self.database_url else get_engine().url
+        url = url.set(drivername="postgresql").render_as_string(hide_password=False)
+        while not self._stop.is_set():
+            try:
+                with psycopg.connect(url, autocommit=True) as conn:
+                    conn.execute(f'LISTEN "{self.channel}"')
+                    while not self._stop.is_set():
+                        for notify in conn.notifies(timeout=1.0):
+                            self.hub.dispatch(json.loads(notify.payload))
+            except Exception as e:
+                print(f"Event listener connection failed: {e}")
+                self._stop.wait(1.0)
+
+
+def create_backend(name: str, hub: EventHub):
+    if name == "local":
+        return LocalBackend(hub)
+    if name == "postgres":
+        return PostgresBackend(hub)
+    raise ValueError(f"Unknown EVENTS_BACKEND: {name}")
+
+
+hub = EventHub()
+backend = create_backend(EVENTS_BACKEND, hub)
+
+
+def publish_event(event_type: str, user_id: int, data: Any) -> None:
+    # A random id is unique across workers and restarts. It identifies an event but does
+    # not order events, and the stream cannot be resumed from it.
+    event = {
+        "id": uuid.uuid4().hex,
+        "type": event_type,
+        "user_id": user_id,
+        "timestamp": datetime.utcnow().isoformat(),
+        "data": data,
+    }
+    try:
+        backend.publish(event)
+    except Exception as e:
+        # a lost notification must never fail the write that triggered it
+        print(f"Event publish failed: {e}")
+
+
+def _format_sse(event_type: str, data: Any, event_id: Any = None) -> str:
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event_type}")
+    lines.append(f"data: {json.dumps(data)}")
+    return "\n".join(lines) + "\n\n"
+
+
+async def event_stream(sub: Subscriber, keepalive: float = EVENTS_KEEPALIVE_SECONDS) -> AsyncIterator[str]:
+    """Server-Sent Events body for one subscriber; ends when the subscriber is closed.
+
+    Resuming is not supported: a Last-Event-ID sent on reconnect is ignored, and events
+    published while the client was disconnected are not replayed.
+    """
+    try:
+        yield ": connected\n\n"
+        while True:
+            try:
+                event = await asyncio.wait_for(sub.queue.get(), timeout=keepalive)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            if event is _CLOSE:
+                yield _format_sse("disconnect", {"reason": sub.close_reason})
+                return
+            yield _format_sse(event["type"], event, event["id"])
+    finally:
+        sub.hub.unsubscribe(sub)
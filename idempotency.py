@@ -0,0 +1,290 @@
+import asyncio
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Callable, NamedTuple
+
+from fastapi import HTTPException, Request
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+from sqlalchemy import and_, delete, or_, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.exc import StaleDataError
+
+from config import (
+    IDEMPOTENCY_TTL_SECONDS,
+    IDEMPOTENCY_CACHE_SIZE,
+    IDEMPOTENCY_WAIT_TIMEOUT_SECONDS,
+    IDEMPOTENCY_PURGE_INTERVAL_SECONDS,
+    IDEMPOTENCY_PURGE_BATCH_SIZE,
+)
+from db_models import IdempotencyKeyORM
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+MAX_KEY_LENGTH = 255
+# How often a request polls the table while another worker owns the same key
+_POLL_INTERVAL_SECONDS = 0.05
+# A pending key whose owner hasn't finished within this long is treated as abandoned
+# (worker killed between claiming the key and committing) and can be taken over
+_LEASE_SECONDS = IDEMPOTENCY_WAIT_TIMEOUT_SECONDS
+
+
+class StoredResponse(NamedTuple):
+    request_hash: str
+    status_code: int
+    body: str
+    expires_at: datetime
+
+
+class LRUCache:
+    """Small thread-safe LRU of completed responses kept in front of the table."""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._data: OrderedDict[tuple[int, str], StoredResponse] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple[int, str]) -> StoredResponse | None:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            if item.expires_at <= datetime.utcnow():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return item
+
+    def put(self, key: tuple[int, str], value: StoredResponse) -> None:
+        if self.capacity <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.capacity:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+
+response_cache = LRUCache(IDEMPOTENCY_CACHE_SIZE)
+
+# Keys currently being executed by this process; duplicates wait on the event
+_inflight: dict[tuple[int, str], threading.Event] = {}
+_inflight_lock = threading.Lock()
+
+
+def request_fingerprint(request: Request, payload: BaseModel) -> str:
+    """Hash of method, path and body used to detect a key reused for a different request."""
+    raw = f"{request.method} {request.url.path}\n{payload.model_dump_json()}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _replay(stored: StoredResponse, request_hash: str) -> JSONResponse:
+    if stored.request_hash != request_hash:
+        raise HTTPException(422, "Idempotency-Key was already used for a different request")
+    return JSONResponse(
+        status_code=stored.status_code,
+        content=json.loads(stored.body),
+        headers={REPLAYED_HEADER: "true"},
+    )
+
+
+def _lease_cutoff(now: datetime) -> datetime:
+    return now - timedelta(seconds=_LEASE_SECONDS)
+
+
+def _lookup(db: Session, user_id: int, key: str) -> tuple[StoredResponse | None, bool]:
+    """Return (stored response, pending) for a key; both empty if the key is unused, expired or abandoned."""
+    cached = response_cache.get((user_id, key))
+    if cached is not None:
+        return cached, False
+    row = db.execute(
+        select(IdempotencyKeyORM).where(
+            IdempotencyKeyORM.user_id == user_id,
+            IdempotencyKeyORM.key == key,
+        )
+    ).scalar_one_or_none()
+    # end the read transaction so the next poll sees other workers' commits
+    db.rollback()
+    now = datetime.utcnow()
+    if row is None or row.expires_at <= now:
+        return None, False
+    if row.status_code is None:
+        return None, row.created_at >= _lease_cutoff(now)
+    stored = StoredResponse(row.request_hash, row.status_code, row.response_body, row.expires_at)
+    response_cache.put((user_id, key), stored)
+    return stored, False
+
+
+def _claim(db: Session, user_id: int, key: str, request_hash: str) -> IdempotencyKeyORM | None:
+    """Insert a pending row for the key. Returns None if another request already holds it.
+
+    An expired row, or a pending row whose lease ran out, is deleted first. If two requests
+    race to take over the same row, the unique constraint lets only one insert win.
+    """
+    now = datetime.utcnow()
+    db.execute(
+        delete(IdempotencyKeyORM).where(
+            IdempotencyKeyORM.user_id == user_id,
+            IdempotencyKeyORM.key == key,
+            or_(
+                IdempotencyKeyORM.expires_at <= now,
+                and_(
+                    IdempotencyKeyORM.status_code.is_(None),
+                    IdempotencyKeyORM.created_at < _lease_cutoff(now),
+                ),
+            ),
+        )
+    )
+    row = IdempotencyKeyORM(
+        user_id=user_id,
+        key=key,
+        request_hash=request_hash,
+        created_at=now,
+        expires_at=now + timedelta(seconds=IDEMPOTENCY_TTL_SECONDS),
+    )
+    db.add(row)
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        return None
+    return row
+
+
+def _execute(
+    db: Session,
+    row: IdempotencyKeyORM,
+    status_code: int,
+    handler: Callable[[], Any],
+    after_commit: Callable[[Any], None] | None,
+) -> JSONResponse:
+    try:
+        body = handler()
+        row.status_code = status_code
+        row.response_body = json.dumps(body)
+        db.add(row)
+        # the response is committed in the same transaction as the write it describes
+        db.commit()
+    except StaleDataError:
+        # our lease ran out and another request took the key over; the write was rolled back
+        db.rollback()
+        raise HTTPException(409, "A request with this Idempotency-Key is still in progress")
+    except Exception:
+        db.rollback()
+        # free the key so the client can retry a request that did not go through
+        db.execute(delete(IdempotencyKeyORM).where(IdempotencyKeyORM.id == row.id))
+        db.commit()
+        raise
+    stored = StoredResponse(row.request_hash, status_code, row.response_body, row.expires_at)
+    response_cache.put((row.user_id, row.key), stored)
+    if after_commit is not None:
+        after_commit(body)
+    return JSONResponse(status_code=status_code, content=body)
+
+
+def run_idempotent(
+    db: Session,
+    user_id: int,
+    key: str | None,
+    request_hash: str,
+    status_code: int,
+    handler: Callable[[], Any],
+    after_commit: Callable[[Any], None] | None = None,
+) -> JSONResponse:
+    """Run ``handler`` at most once per (user, Idempotency-Key).
+
+    ``handler`` performs the write without committing and returns a JSON-serialisable body.
+    Retries with the same key get the stored response back; concurrent duplicates wait for
+    the first request to finish. Without a key the handler simply runs and is committed.
+    ``after_commit`` is called with the body once the write is committed, but not on replays.
+    """
+    if key is None:
+        body = handler()
+        db.commit()
+        if after_commit is not None:
+            after_commit(body)
+        return JSONResponse(status_code=status_code, content=body)
+    if not key or len(key) > MAX_KEY_LENGTH:
+        raise HTTPException(400, f"{IDEMPOTENCY_HEADER} header must be 1-{MAX_KEY_LENGTH} characters")
+
+    cache_key = (user_id, key)
+    deadline = time.monotonic() + IDEMPOTENCY_WAIT_TIMEOUT_SECONDS
+    while True:
+        stored, pending = _lookup(db, user_id, key)
+        if stored is not None:
+            return _replay(stored, request_hash)
+
+        if not pending:
+            with _inflight_lock:
+                event = _inflight.get(cache_key)
+                owner = event is None
+                if owner:
+                    event = threading.Event()
+                    _inflight[cache_key] = event
+            if owner:
+                try:
+                    row = _claim(db, user_id, key, request_hash)
+                    if row is not None:
+                        return _execute(db, row, status_code, handler, after_commit)
+                finally:
+                    with _inflight_lock:
+                        _inflight.pop(cache_key, None)
+                    event.set()
+            else:
+                remaining = deadline - time.monotonic()
+                if remaining > 0 and event.wait(remaining):
+                    continue
+
+        # another worker owns the key: poll the table until it finishes
+        if time.monotonic() >= deadline:
+            raise HTTPException(409, "A request with this Idempotency-Key is still in progress")
+        time.sleep(_POLL_INTERVAL_SECONDS)
+
+
+def purge_expired_keys(db: Session, batch_size: int = IDEMPOTENCY_PURGE_BATCH_SIZE) -> int:
+    """Delete expired keys in batches so a large backlog never holds one long lock."""
+    total = 0
+    while True:
+        ids = db.execute(
+            select(IdempotencyKeyORM.id)
+            .where(IdempotencyKeyORM.expires_at <= datetime.utcnow())
+            .limit(batch_size)
+        ).scalars().all()
+        if not ids:
+            break
+        db.execute(delete(IdempotencyKeyORM).where(IdempotencyKeyORM.id.in_(ids)))
+        db.commit()
+        total += len(ids)
+        if len(ids) < batch_size:
+            break
+    return total
+
+
+def _purge_once(session_factory: Callable[[], Session]) -> int:
+    db = session_factory()
+    try:
+        return purge_expired_keys(db)
+    finally:
+        db.close()
+
+
+async def purge_expired_keys_forever(
+    session_factory: Callable[[], Session],
+    interval: float = IDEMPOTENCY_PURGE_INTERVAL_SECONDS,
+) -> None:
+    """Background task started from the app lifespan."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await asyncio.to_thread(_purge_once, session_factory)
+        except Exception as e:
+            print(f"Idempotency key purge failed: {e}")
@@ -0,0 +1,208 @@
+from datetime import datetime
+from decimal import Decimal, ROUND_HALF_UP
+
+from sqlalchemy import Numeric, String, cast, delete, extract, func, literal, null, select, union_all
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from db_models import AccountORM, RecordORM, DepositORM, BalanceCheckpointORM
+
+_CENTS = Decimal("0.01")
+
+
+def _money(value) -> Decimal:
+    return Decimal(str(value or 0)).quantize(_CENTS)
+
+
+def to_cents(amount) -> Decimal:
+    """Round a record amount to cents as the client wrote it (1.005 -> 1.01).
+
+    Records are rounded once, when they are written. The stored amount, the debit and
+    the refund on delete all use this value, so the ledger always adds up to the account.
+    """
+    return Decimal(str(amount)).quantize(_CENTS, rounding=ROUND_HALF_UP)
+
+
+def _month_start(dt: datetime) -> datetime:
+    return dt.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def _next_month(dt: datetime) -> datetime:
+    if dt.month == 12:
+        return dt.replace(year=dt.year + 1, month=1)
+    return dt.replace(month=dt.month + 1)
+
+
+def _ledger(user_id: int, start: datetime | None = None, end: datetime | None = None, end_inclusive: bool = False):
+    """Records (as debits) and deposits of one user as a single signed subquery.
+
+    ``start`` is inclusive; ``end`` is exclusive unless ``end_inclusive`` is set.
+    """
+    def in_range(column):
+        conditions = []
+        if start is not None:
+            conditions.append(column >= start)
+        if end is not None:
+            conditions.append(column <= end if end_inclusive else column < end)
+        return conditions
+
+    debits = select(
+        literal("record", String).label("kind"),
+        RecordORM.id.label("id"),
+        RecordORM.category_id.label("category_id"),
+        (-cast(RecordORM.amount, Numeric(14, 2))).label("amount"),
+        RecordORM.timestamp.label("timestamp"),
+    ).where(RecordORM.user_id == user_id, *in_range(RecordORM.timestamp))
+    credits = select(
+        literal("deposit", String).label("kind"),
+        DepositORM.id.label("id"),
+        null().label("category_id"),
+        DepositORM.amount.label("amount"),
+        DepositORM.timestamp.label("timestamp"),
+    ).where(DepositORM.user_id == user_id, *in_range(DepositORM.timestamp))
+    return union_all(debits, credits).subquery("ledger")
+
+
+def _ledger_sum(db: Session, user_id: int, start: datetime | None, end: datetime) -> Decimal:
+    ledger = _ledger(user_id, start, end)
+    return _money(db.execute(select(func.coalesce(func.sum(ledger.c.amount), 0))).scalar())
+
+
+def _monthly_sums(db: Session, user_id: int, start: datetime | None, end: datetime) -> list[tuple[datetime, Decimal]]:
+    """Net ledger amount per calendar month in [start, end), only for months that have entries."""
+    ledger = _ledger(user_id, start, end)
+    year = extract("year", ledger.c.timestamp)
+    month = extract("month", ledger.c.timestamp)
+    rows = db.execute(
+        select(year.label("year"), month.label("month"), func.sum(ledger.c.amount).label("total"))
+        .group_by(year, month)
+        .order_by(year, month)
+    ).all()
+    return [(datetime(int(row.year), int(row.month), 1), _money(row.total)) for row in rows]
+
+
+def lock_account(db: Session, user_id: int) -> AccountORM | None:
+    """Lock the user's account row until commit.
+
+    Every ledger write, and every statement that stores checkpoints, takes this
+    lock first. A statement therefore can't store checkpoints that miss a
+    concurrent (backdated) entry.
+    """
+    return db.execute(
+        select(AccountORM).where(AccountORM.user_id == user_id).with_for_update()
+    ).scalar_one_or_none()
+
+
+def invalidate_checkpoints(db: Session, user_id: int, timestamp: datetime) -> None:
+    """Drop checkpoints made stale by an entry written at ``timestamp`` (records may be backdated)."""
+    db.execute(
+        delete(BalanceCheckpointORM).where(
+            BalanceCheckpointORM.user_id == user_id,
+            BalanceCheckpointORM.as_of > timestamp,
+        )
+    )
+
+
+def _balance_before(db: Session, user_id: int, as_of: datetime) -> tuple[Decimal, list[BalanceCheckpointORM]]:
+    """Balance of all entries before the month start ``as_of``, seeking from the nearest checkpoint.
+
+    Also returns the checkpoints that are missing for months that have already ended and
+    had entries, built from a single grouped query; they are not added to the session.
+    Anything after the current month start is summed on the fly and never stored.
+    """
+    checkpoint = db.execute(
+        select(BalanceCheckpointORM)
+        .where(BalanceCheckpointORM.user_id == user_id, BalanceCheckpointORM.as_of <= as_of)
+        .order_by(BalanceCheckpointORM.as_of.desc())
+        .limit(1)
+    ).scalar_one_or_none()
+    if checkpoint is not None and checkpoint.as_of == as_of:
+        return _money(checkpoint.balance), []
+
+    if checkpoint is not None:
+        start, balance = checkpoint.as_of, _money(checkpoint.balance)
+    else:
+        start, balance = None, Decimal("0.00")
+
+    closed = min(as_of, _month_start(datetime.utcnow()))
+    new_checkpoints = []
+    if start is None or start < closed:
+        for month, total in _monthly_sums(db, user_id, start, closed):
+            balance += total
+            new_checkpoints.append(BalanceCheckpointORM(user_id=user_id, as_of=_next_month(month), balance=balance))
+        start = closed
+    if start < as_of:
+        balance += _ledger_sum(db, user_id, start, as_of)
+    return balance, new_checkpoints
+
+
+def store_checkpoints(db: Session, user_id: int, as_of: datetime) -> None:
+    """Store the checkpoints missing before ``as_of`` in their own transaction.
+
+    They are recomputed once the account lock is held, so they can't miss an entry
+    committed by a write that ran after the caller's read.
+    """
+    lock_account(db, user_id)
+    _, new_checkpoints = _balance_before(db, user_id, as_of)
+    db.add_all(new_checkpoints)
+    try:
+        db.commit()
+    except IntegrityError:
+        # a concurrent statement already wrote the same checkpoints
+        db.rollback()
+
+
+def _begin_snapshot(db: Session) -> None:
+    """Start a transaction in which every read sees the same snapshot.
+
+    Postgres needs REPEATABLE READ for that. On SQLite the default transaction is used.
+    """
+    db.rollback()
+    if db.get_bind().dialect.name == "postgresql":
+        db.connection(execution_options={"isolation_level": "REPEATABLE READ"})
+
+
+def build_statement(db: Session, user_id: int, start: datetime | None, end: datetime) -> dict:
+    """Ledger entries in [start, end] with running balances computed by a window function.
+
+    The opening balance and the entries come from one read-only snapshot and take no locks.
+    Missing checkpoints are stored afterwards.
+    """
+    _begin_snapshot(db)
+    missing_checkpoints = False
+    if start is None:
+        opening = Decimal("0.00")
+    else:
+        month = _month_start(start)
+        balance, new_checkpoints = _balance_before(db, user_id, month)
+        opening = balance + _ledger_sum(db, user_id, month, start)
+        missing_checkpoints = bool(new_checkpoints)
+
+    ledger = _ledger(user_id, start, end, end_inclusive=True)
+    ordering = (ledger.c.timestamp, ledger.c.kind, ledger.c.id)
+    running = func.sum(ledger.c.amount).over(order_by=ordering, rows=(None, 0))
+    rows = db.execute(select(ledger, running.label("running")).order_by(*ordering)).all()
+    db.rollback()
+
+    if missing_checkpoints:
+        store_checkpoints(db, user_id, month)
+
+    entries = [
+        {
+            "kind": row.kind,
+            "id": row.id,
+            "category_id": row.category_id,
+            "amount": _money(row.amount),
+            "timestamp": row.timestamp,
+            "balance": opening + _money(row.running),
+        }
+        for row in rows
+    ]
+    return {
+        "user_id": user_id,
+        "start": start,
+        "end": end,
+        "opening_balance": opening,
+        "closing_balance": entries[-1]["balance"] if entries else opening,
+        "entries": entries,
+    }
@@ -1,78 +1,48 @@
-from fastapi import FastAPI, HTTPException, Query, Depends, Response
+from fastapi import FastAPI, APIRouter, HTTPException, Query, Depends, Response, Header
 from models import (
     User, UserCreate, UserWithToken,
     Category, CategoryCreate,
     Record, RecordCreate,
     Account, AccountDeposit,
+    Statement,
 )
 from sqlalchemy.orm import Session
-from database import get_db, init_db
-from db_models import UserORM, CategoryORM, RecordORM, AccountORM
+from database import get_db, init_db, configure_database, new_session
+from db_models import UserORM, CategoryORM, RecordORM, AccountORM, DepositORM
 from fastapi.responses import JSONResponse
 from fastapi.requests import Request
-from datetime import datetime
+from datetime import datetime, timezone
 from fastapi.openapi.docs import get_swagger_ui_html
-from config import (
-    API_TITLE,
-    API_VERSION,
-    OPENAPI_URL_PREFIX,
-    OPENAPI_SWAGGER_UI_PATH,
-    OPENAPI_SWAGGER_UI_URL,
-    REDOC_PATH,
-)
+from config import Settings
 from contextlib import asynccontextmanager
+import asyncio
+from decimal import Decimal
+from idempotency import IDEMPOTENCY_HEADER, request_fingerprint, run_idempotent, purge_expired_keys_forever
+from fastapi.responses import StreamingResponse
+import events
+from events import publish_event, event_stream, RECORD_CREATED, RECORD_DELETED, BALANCE_CHANGED
+from ledger import build_statement, invalidate_checkpoints, lock_account, to_cents
 from auth import get_password_hash, verify_password, create_access_token, jwt_required
 from auth import JWTExpiredError, JWTInvalidError, JWTMissingError
 from fastapi.responses import JSONResponse as FastJSONResponse
 from fastapi import status as _status
 
-app = FastAPI(
-    title=API_TITLE,
-    version=API_VERSION,
-    openapi_url=f"{OPENAPI_URL_PREFIX}openapi.json",
-    docs_url=None,  
-    redoc_url=REDOC_PATH,
-)
-
-@asynccontextmanager
-async def app_lifespan(app: FastAPI):
-    init_db()
-    yield
-
-app = FastAPI(
-    title=API_TITLE,
-    version=API_VERSION,
-    openapi_url=f"{OPENAPI_URL_PREFIX}openapi.json",
-    docs_url=None,  # disable default docs to serve custom swagger using CDN
-    redoc_url=REDOC_PATH,
-    lifespan=app_lifespan,
-)
-
+router = APIRouter()
 
-@app.get(OPENAPI_SWAGGER_UI_PATH, include_in_schema=False)
-def custom_swagger_ui():
-    return get_swagger_ui_html(
-        openapi_url=app.openapi_url,
-        title=f"{API_TITLE} - Swagger UI",
-        swagger_js_url=f"{OPENAPI_SWAGGER_UI_URL}/swagger-ui-bundle.js",
-        swagger_css_url=f"{OPENAPI_SWAGGER_UI_URL}/swagger-ui.css",
-    )
 
-@app.exception_handler(HTTPException)
 async def http_exception_handler(request: Request, exc: HTTPException):
     return JSONResponse(
         status_code=exc.status_code,
         content={"status": exc.status_code, "error": exc.detail}
     )
 
-@app.exception_handler(Exception)
 async def global_exception_handler(request: Request, exc: Exception):
     return JSONResponse(
         status_code=500,
         content={"status": 500, "error": str(exc)}
     )
 
-@app.post("/register", response_model=UserWithToken, status_code=201)
+@router.post("/register", response_model=UserWithToken, status_code=201)
 def register_user(user: UserCreate, db: Session = Depends(get_db)):
     db_user = db.query(UserORM).filter(UserORM.name == user.name).first()
     if db_user:
@@ -96,7 +66,7 @@ def register_user(user: UserCreate, db: Session = Depends(get_db)):
     }
 
 
-@app.post("/login", response_model=UserWithToken)
+@router.post("/login", response_model=UserWithToken)
 def login(user_data: UserCreate, db: Session = Depends(get_db)):
     # Authenticate by name and password
     user = db.query(UserORM).filter(UserORM.name == user_data.name).first()
@@ -110,18 +80,18 @@ def login(user_data: UserCreate, db: Session = Depends(get_db)):
         "token_type": "bearer"
     }
 
-@app.get("/users/{user_id}", response_model=User)
+@router.get("/users/{user_id}", response_model=User)
 def get_user(user_id: int, db: Session = Depends(get_db), current_user: UserORM = Depends(jwt_required)):
     obj = db.query(UserORM).filter(UserORM.id == user_id).first()
     if not obj:
         raise HTTPException(404, "User not found")
     return obj
 
-@app.get("/users", response_model=list[User])
+@router.get("/users", response_model=list[User])
 def list_users(db: Session = Depends(get_db), current_user: UserORM = Depends(jwt_required)):
     return db.query(UserORM).all()
 
-@app.delete("/users/{user_id}", status_code=204)
+@router.delete("/users/{user_id}", status_code=204)
 def delete_user(user_id: int, db: Session = Depends(get_db), current_user: UserORM = Depends(jwt_required)):
     if current_user.id != user_id:
         raise HTTPException(status_code=403, detail="Cannot delete other users")
@@ -132,7 +102,7 @@ def delete_user(user_id: int, db: Session = Depends(get_db), current_user: UserO
     db.commit()
     return Response(status_code=204)
 
-@app.post("/categories/", response_model=Category, status_code=201)
+@router.post("/categories/", response_model=Category, status_code=201)
 def create_category(category: CategoryCreate, db: Session = Depends(get_db), current_user: UserORM = Depends(jwt_required)):
     obj = CategoryORM(title=category.title)
     db.add(obj)
@@ -140,18 +110,18 @@ def create_category(category: CategoryCreate, db: Session = Depends(get_db), cur
     db.refresh(obj)
     return obj
 
-@app.get("/categories/{category_id}", response_model=Category)
+@router.get("/categories/{category_id}", response_model=Category)
 def get_category(category_id: int, db: Session = Depends(get_db), current_user: UserORM = Depends(jwt_required)):
     obj = db.query(CategoryORM).filter(CategoryORM.id == category_id).first()
     if not obj:
         raise HTTPException(404, "Category not found")
     return obj
 
-@app.get("/categories", response_model=list[Category])
+@router.get("/categories", response_model=list[Category])
 def list_categories(db: Session = Depends(get_db), current_user: UserORM = Depends(jwt_required)):
     return db.query(CategoryORM).all()
 
-@app.delete("/categories/{category_id}", status_code=204)
+@router.delete("/categories/{category_id}", status_code=204)
 def delete_category(category_id: int, db: Session = Depends(get_db), current_user: UserORM = Depends(jwt_required)):
     obj = db.query(CategoryORM).filter(CategoryORM.id == category_id).first()
     if not obj:
@@ -160,45 +130,62 @@ def delete_category(category_id: int, db: Session = Depends(get_db), current_use
     db.commit()
     return Response(status_code=204)
 
-@app.post("/records/", response_model=Record, status_code=201)
-def create_record(record: RecordCreate, db: Session = Depends(get_db), current_user: UserORM = Depends(jwt_required)):
+@router.post("/records/", response_model=Record, status_code=201)
+def create_record(
+    record: RecordCreate,
+    request: Request,
+    idempotency_key: str | None = Header(None, alias=IDEMPOTENCY_HEADER),
+    db: Session = Depends(get_db),
+    current_user: UserORM = Depends(jwt_required),
+):
     # Use authenticated user's ID
     user_id = current_user.id
-    
-    if not db.query(CategoryORM).filter(CategoryORM.id == record.category_id).first():
-        raise HTTPException(404, "Category not found")
-    
-    acc = db.query(AccountORM).filter(AccountORM.user_id == user_id).first()
-    if not acc:
-        raise HTTPException(404, "Account not found")
-    
-    if acc.balance is None:
-        acc.balance = 0
-    if acc.balance < record.amount:
-        raise HTTPException(400, "Insufficient funds")
-
-    from decimal import Decimal
-    acc.balance = acc.balance - Decimal(record.amount)
-    obj = RecordORM(
-        user_id=user_id,
-        category_id=record.category_id,
-        amount=record.amount,
-        timestamp=record.timestamp,
-    )
-    db.add(obj)
-    db.add(acc)
-    db.commit()
-    db.refresh(obj)
-    return obj
+    changed = {}
+
+    def handler():
+        if not db.query(CategoryORM).filter(CategoryORM.id == record.category_id).first():
+            raise HTTPException(404, "Category not found")
+
+        acc = lock_account(db, user_id)
+        if not acc:
+            raise HTTPException(404, "Account not found")
+
+        if acc.balance is None:
+            acc.balance = 0
+        amount = to_cents(record.amount)
+        if acc.balance < amount:
+            raise HTTPException(400, "Insufficient funds")
+
+        acc.balance = acc.balance - amount
+        obj = RecordORM(
+            user_id=user_id,
+            category_id=record.category_id,
+            amount=float(amount),
+            timestamp=record.timestamp,
+        )
+        db.add(obj)
+        db.add(acc)
+        invalidate_checkpoints(db, user_id, record.timestamp)
+        db.flush()
+        db.refresh(obj)
+        db.refresh(acc)
+        changed["account"] = Account.model_validate(acc).model_dump(mode="json")
+        return Record.model_validate(obj).model_dump(mode="json")
+
+    def after_commit(record_body):
+        publish_event(RECORD_CREATED, user_id, record_body)
+        publish_event(BALANCE_CHANGED, user_id, changed["account"])
+
+    return run_idempotent(db, user_id, idempotency_key, request_fingerprint(request, record), 201, handler, after_commit)
 
-@app.get("/records/{record_id}", response_model=Record)
+@router.get("/records/{record_id}", response_model=Record)
 def get_record(record_id: int, db: Session = Depends(get_db), current_user: UserORM = Depends(jwt_required)):
     obj = db.query(RecordORM).filter(RecordORM.id == record_id).first()
     if not obj:
         raise HTTPException(404, "Record not found")
     return obj
 
-@app.get("/records", response_model=list[Record])
+@router.get("/records", response_model=list[Record])
 def list_records(user_id: int | None = Query(None, ge=1), category_id: int | None = Query(None, ge=1), db: Session = Depends(get_db), current_user: UserORM = Depends(jwt_required)):
     query = db.query(RecordORM)
     if user_id is not None:
@@ -207,7 +194,7 @@ def list_records(user_id: int | None = Query(None, ge=1), category_id: int | Non
         query = query.filter(RecordORM.category_id == category_id)
     return query.all()
 
-@app.delete("/records/{record_id}", status_code=204)
+@router.delete("/records/{record_id}", status_code=204)
 def delete_record(record_id: int, db: Session = Depends(get_db), current_user: UserORM = Depends(jwt_required)):
     obj = db.query(RecordORM).filter(RecordORM.id == record_id).first()
     if not obj:
@@ -215,11 +202,23 @@ def delete_record(record_id: int, db: Session = Depends(get_db), current_user: U
     # only owner can delete their record
     if obj.user_id != current_user.id:
         raise HTTPException(status_code=403, detail="Cannot delete other user's record")
+    record_body = Record.model_validate(obj).model_dump(mode="json")
+    # deleting an expense refunds it, so the ledger keeps adding up to the account balance
+    acc = lock_account(db, obj.user_id)
+    if acc is not None:
+        acc.balance = (acc.balance or 0) + to_cents(obj.amount)
+        db.add(acc)
+    if obj.timestamp is not None:
+        invalidate_checkpoints(db, obj.user_id, obj.timestamp)
     db.delete(obj)
     db.commit()
+    publish_event(RECORD_DELETED, current_user.id, record_body)
+    if acc is not None:
+        db.refresh(acc)
+        publish_event(BALANCE_CHANGED, current_user.id, Account.model_validate(acc).model_dump(mode="json"))
     return Response(status_code=204)
 
-@app.get("/accounts/{user_id}", response_model=Account)
+@router.get("/accounts/{user_id}", response_model=Account)
 def get_account(user_id: int, db: Session = Depends(get_db), current_user: UserORM = Depends(jwt_required)):
     acc = db.query(AccountORM).filter(AccountORM.user_id == user_id).first()
     if not acc:
@@ -227,40 +226,98 @@ def get_account(user_id: int, db: Session = Depends(get_db), current_user: UserO
     return acc
 
 
-@app.post("/accounts/{user_id}/deposit", response_model=Account)
-def deposit_account(user_id: int, payload: AccountDeposit, db: Session = Depends(get_db), current_user: UserORM = Depends(jwt_required)):
+def _naive_utc(value: datetime | None) -> datetime | None:
+    # timestamps are stored as naive UTC
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+@router.get("/accounts/{user_id}/statement", response_model=Statement)
+def get_statement(
+    user_id: int,
+    start: datetime | None = Query(None, alias="from"),
+    end: datetime | None = Query(None, alias="to"),
+    db: Session = Depends(get_db),
+    current_user: UserORM = Depends(jwt_required),
+):
+    # Statements expose every deposit and expense, so only the owner may read one
+    if current_user.id != user_id:
+        raise HTTPException(status_code=403, detail="Cannot view other user's statement")
+    start, end = _naive_utc(start), _naive_utc(end) or datetime.utcnow()
+    if start is not None and start > end:
+        raise HTTPException(400, "'from' must not be after 'to'")
+    return build_statement(db, user_id, start, end)
+
+
+@router.post("/accounts/{user_id}/deposit", response_model=Account)
+def deposit_account(
+    user_id: int,
+    payload: AccountDeposit,
+    request: Request,
+    idempotency_key: str | None = Header(None, alias=IDEMPOTENCY_HEADER),
+    db: Session = Depends(get_db),
+    current_user: UserORM = Depends(jwt_required),
+):
     # Only allow deposits to the authenticated user's account
     if current_user.id != user_id:
         raise HTTPException(status_code=403, detail="Cannot deposit to other user's account")
-    acc = db.query(AccountORM).filter(AccountORM.user_id == user_id).first()
-    if not acc:
-        user = db.query(UserORM).filter(UserORM.id == user_id).first()
-        if not user:
-            raise HTTPException(404, "User not found")
-        acc = AccountORM(user_id=user_id, balance=0)
+
+    def handler():
+        acc = lock_account(db, user_id)
+        if not acc:
+            user = db.query(UserORM).filter(UserORM.id == user_id).first()
+            if not user:
+                raise HTTPException(404, "User not found")
+            acc = AccountORM(user_id=user_id, balance=0)
+            db.add(acc)
+            db.flush()
+        if acc.balance is None:
+            acc.balance = 0
+        acc.balance = acc.balance + Decimal(payload.amount)
+        deposit = DepositORM(user_id=user_id, amount=payload.amount, timestamp=datetime.utcnow())
         db.add(acc)
+        db.add(deposit)
+        invalidate_checkpoints(db, user_id, deposit.timestamp)
         db.flush()
-    from decimal import Decimal
-    if acc.balance is None:
-        acc.balance = 0
-    acc.balance = acc.balance + Decimal(payload.amount)
-    db.add(acc)
-    db.commit()
-    db.refresh(acc)
-    return acc
+        db.refresh(acc)
+        return Account.model_validate(acc).model_dump(mode="json")
+
+    def after_commit(account_body):
+        publish_event(BALANCE_CHANGED, user_id, account_body)
+
+    return run_idempotent(db, user_id, idempotency_key, request_fingerprint(request, payload), 200, handler, after_commit)
 
 
-@app.get("/")
+@router.get("/events")
+def stream_events(db: Session = Depends(get_db), current_user: UserORM = Depends(jwt_required)):
+    """Server-Sent Events stream of record and balance changes for the authenticated user."""
+    user_id = current_user.id
+    # don't hold a pooled connection open for the lifetime of the stream
+    db.close()
+    return StreamingResponse(
+        _subscribe_and_stream(user_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def _subscribe_and_stream(user_id: int):
+    sub = events.hub.subscribe(user_id)
+    async for chunk in event_stream(sub):
+        yield chunk
+
+
+@router.get("/")
 def hello_world():
     return {"message": "Hello, World!"}
 
-@app.get("/healthcheck")
+@router.get("/healthcheck")
 def healthcheck():
     return {"status": "ok"}
 
 
 # JWT error handlers (FastAPI equivalents of Flask-JWT-Extended callbacks)
-@app.exception_handler(JWTExpiredError)
 async def expired_token_callback(request, exc: JWTExpiredError):
     return FastJSONResponse(
         status_code=_status.HTTP_401_UNAUTHORIZED,
@@ -268,7 +325,6 @@ async def expired_token_callback(request, exc: JWTExpiredError):
     )
 
 
-@app.exception_handler(JWTInvalidError)
 async def invalid_token_callback(request, exc: JWTInvalidError):
     return FastJSONResponse(
         status_code=_status.HTTP_401_UNAUTHORIZED,
@@ -276,7 +332,6 @@ async def invalid_token_callback(request, exc: JWTInvalidError):
     )
 
 
-@app.exception_handler(JWTMissingError)
 async def missing_token_callback(request, exc: JWTMissingError):
     return FastJSONResponse(
         status_code=_status.HTTP_401_UNAUTHORIZED,
@@ -284,4 +339,65 @@ async def missing_token_callback(request, exc: JWTMissingError):
             "description": "Request does not contain an access token.",
             "error": "authorization_required",
         },
-    )
\ No newline at end of file
+    )
+
+
+def create_app(settings: Settings | None = None) -> FastAPI:
+    """Build the application. Run with ``uvicorn main:app`` or ``uvicorn --factory main:create_app``."""
+    settings = settings or Settings()
+    configure_database(settings.database_url)
+
+    @asynccontextmanager
+    async def app_lifespan(app: FastAPI):
+        if settings.create_schema:
+            init_db()
+        events.hub.closing = False
+        events.backend.start()
+        restore_signal_handlers = events.install_shutdown_signal_handlers(events.hub)
+        purge_task = asyncio.create_task(purge_expired_keys_forever(new_session))
+        yield
+        purge_task.cancel()
+        # normally already done by the signal handler; covers servers that stop without a signal
+        events.hub.close_all()
+        restore_signal_handlers()
+        events.backend.stop()
+
+    app = FastAPI(
+        title=settings.api_title,
+        version=settings.api_version,
+        openapi_url=f"{settings.openapi_url_prefix}openapi.json",
+        docs_url=None,  # disable default docs to serve custom swagger using CDN
+        redoc_url=settings.redoc_path,
+        lifespan=app_lifespan,
+    )
+
+    @app.get(settings.openapi_swagger_ui_path, include_in_schema=False)
+    def custom_swagger_ui():
+        return get_swagger_ui_html(
+            openapi_url=app.openapi_url,
+            title=f"{settings.api_title} - Swagger UI",
+            swagger_js_url=f"{settings.openapi_swagger_ui_url}/swagger-ui-bundle.js",
+            swagger_css_url=f"{settings.openapi_swagger_ui_url}/swagger-ui.css",
+        )
+
+    app.include_router(router)
+    app.add_exception_handler(HTTPException, http_exception_handler)
+    app.add_exception_handler(Exception, global_exception_handler)
+    app.add_exception_handler(JWTExpiredError, expired_token_callback)
+    app.add_exception_handler(JWTInvalidError, invalid_token_callback)
+    app.add_exception_handler(JWTMissingError, missing_token_callback)
+    return app
+
+
+_app: FastAPI | None = None
+
+
+def __getattr__(name: str):
+    # `main.app` is built on first access, so importing this module (e.g. for
+    # create_app in tests) doesn't construct an app that is never used
+    global _app
+    if name == "app":
+        if _app is None:
+            _app = create_app()
+        return _app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
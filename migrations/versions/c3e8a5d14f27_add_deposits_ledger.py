@@ -0,0 +1,66 @@
+"""add deposits ledger and balance checkpoints
+
+Revision ID: c3e8a5d14f27
+Revises: 4b1f6c2a7d90
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c3e8a5d14f27'
+down_revision: Union[str, Sequence[str], None] = '4b1f6c2a7d90'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('deposits',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('amount', sa.Numeric(precision=14, scale=2), nullable=False),
+    sa.Column('timestamp', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_deposits_id'), 'deposits', ['id'], unique=False)
+    op.create_index('ix_deposits_user_id_timestamp', 'deposits', ['user_id', 'timestamp'], unique=False)
+    op.create_table('balance_checkpoints',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('as_of', sa.DateTime(), nullable=False),
+    sa.Column('balance', sa.Numeric(precision=14, scale=2), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('user_id', 'as_of', name='uq_balance_checkpoints_user_as_of')
+    )
+    op.create_index('ix_records_user_id_timestamp', 'records', ['user_id', 'timestamp'], unique=False)
+
+    # Deposits used to only change accounts.balance. Record what was deposited before
+    # this migration as one opening deposit per account, dated no later than its first
+    # record, so the ledger adds up to the current balance.
+    op.execute("""
+        INSERT INTO deposits (user_id, amount, timestamp)
+        SELECT a.user_id,
+               a.balance + COALESCE(r.spent, 0),
+               COALESCE(r.first_at, CURRENT_TIMESTAMP)
+        FROM accounts a
+        LEFT JOIN (
+            SELECT user_id, SUM(amount) AS spent, MIN(timestamp) AS first_at
+            FROM records
+            GROUP BY user_id
+        ) r ON r.user_id = a.user_id
+        WHERE a.balance + COALESCE(r.spent, 0) <> 0
+    """)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_records_user_id_timestamp', table_name='records')
+    op.drop_table('balance_checkpoints')
+    op.drop_index('ix_deposits_user_id_timestamp', table_name='deposits')
+    op.drop_index(op.f('ix_deposits_id'), table_name='deposits')
+    op.drop_table('deposits')
@@ -2,6 +2,7 @@ from pydantic import BaseModel, Field, field_validator
 from pydantic import ConfigDict
 from decimal import Decimal
 from datetime import datetime
+from typing import Literal
 
 class UserBase(BaseModel):
     name: str = Field(..., min_length=2, max_length=50)
@@ -60,4 +61,20 @@ class Account(AccountBase):
     balance: Decimal
 
 class AccountDeposit(BaseModel):
-    amount: Decimal = Field(..., gt=0)
\ No newline at end of file
+    amount: Decimal = Field(..., gt=0)
+
+class StatementEntry(BaseModel):
+    kind: Literal["deposit", "record"]
+    id: int
+    category_id: int | None = None
+    amount: Decimal
+    timestamp: datetime
+    balance: Decimal
+
+class Statement(BaseModel):
+    user_id: int
+    start: datetime | None
+    end: datetime
+    opening_balance: Decimal
+    closing_balance: Decimal
+    entries: list[StatementEntry]
\ No newline at end of file